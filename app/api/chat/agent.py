@@ -4,13 +4,19 @@ from supabase import create_client
 from openai import OpenAI  
 
 import google.generativeai as genai
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Union
+from collections import Counter, OrderedDict, defaultdict
+from bisect import bisect_left
 import uvicorn
 import json
+import re
+import time
+import threading
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -22,6 +28,17 @@ app = FastAPI(
 # Load environment variables
 load_dotenv()
 
+# Survey used when a request does not name one
+DEFAULT_SURVEY_ID = os.getenv('DEFAULT_SURVEY_ID', 'default')
+# Surveys whose catalogs, indexes and query context are kept in memory
+MAX_CACHED_SURVEYS = int(os.getenv('MAX_CACHED_SURVEYS', '8'))
+# Seconds before a survey's question catalog is reloaded from the database
+CATALOG_TTL_SECONDS = int(os.getenv('CATALOG_TTL_SECONDS', '300'))
+# Seconds before a survey's verbatim index is rebuilt; the stale index is served meanwhile
+VERBATIM_INDEX_TTL_SECONDS = int(os.getenv('VERBATIM_INDEX_TTL_SECONDS', str(CATALOG_TTL_SECONDS)))
+# Largest page the verbatim search endpoints return
+MAX_VERBATIM_PAGE_SIZE = 1000
+
 # Update CORS middleware with proper frontend URL
 app.add_middleware(
     CORSMiddleware,
@@ -40,6 +57,7 @@ app.add_middleware(
 # Pydantic models for request/response
 class QueryRequest(BaseModel):
     query: str
+    survey_id: Optional[str] = None
 
 class QueryResponse(BaseModel):
     response: str
@@ -49,11 +67,123 @@ class ValidationResponse(BaseModel):
     message: Optional[str] = None
     similar_questions: Optional[List[str]] = None
 
+class VerbatimSearchResponse(BaseModel):
+    total: int
+    matches: List[Dict]
+    next_cursor: Optional[int] = None
+
+class SurveyCatalog:
+    # Distinct questions of one survey, loaded from get_survey_catalog so question
+    # lookups are answered from memory instead of ILIKE scans over survey_responses.
+    # The catalog is reloaded after CATALOG_TTL_SECONDS, and once before a question is
+    # reported missing, so data loaded into a live survey shows up without eviction.
+    # A miss reloads at most every MISS_RELOAD_SECONDS, so repeated typos do not hit the DB.
+    MISS_RELOAD_SECONDS = 5
+
+    def __init__(self, supabase, survey_id):
+        self.supabase = supabase
+        self.survey_id = survey_id
+        self.entries = None
+        self.loaded_at = 0.0
+
+    def load(self, refresh=False):
+        if self.entries is not None and not refresh and \
+           time.monotonic() - self.loaded_at < CATALOG_TTL_SECONDS:
+            return self.entries
+
+        # One JSONB array, so PostgREST's row cap cannot truncate large catalogs
+        result = self.supabase.rpc('get_survey_catalog', {'p_survey_id': self.survey_id}).execute()
+        entries = [
+            {
+                'question_id': item['question_id'],
+                'sub_question': item['sub_question'] or '',
+                'question_type': item['question_type'],
+                'closed_ended': item['closed_ended'],
+            }
+            for item in result.data or []
+        ]
+
+        # Lookup tables; types and grids only cover questions with closed (non open_ended) answers
+        question_ids = {e['question_id'] for e in entries}
+        sub_questions = {e['sub_question'] for e in entries if e['sub_question']}
+        types = {}
+        grids = defaultdict(list)
+        for e in entries:
+            if not e['closed_ended']:
+                continue
+            qid = e['question_id']
+            types.setdefault(qid.upper(), e['question_type'])
+            if '[' in qid and qid.endswith(']'):
+                grids[qid.split('[')[0].upper()].append(qid)
+
+        self.question_ids, self.sub_questions, self.types, self.grids = question_ids, sub_questions, types, grids
+        self.entries = entries
+        self.loaded_at = time.monotonic()
+        return entries
+
+    def _reload_after_miss(self):
+        if time.monotonic() - self.loaded_at < self.MISS_RELOAD_SECONDS:
+            return False
+        self.load(refresh=True)
+        return True
+
+    def _find(self, question_id):
+        needle = question_id.upper()
+        return [
+            e for e in self.load()
+            if needle in e['question_id'].upper() or needle in e['sub_question'].upper()
+        ]
+
+    def find(self, question_id):
+        # Case-insensitive substring match on question_id or sub_question
+        matches = self._find(question_id)
+        if not matches and self._reload_after_miss():
+            matches = self._find(question_id)
+        return matches
+
+    def _exists(self, question_id):
+        self.load()
+        return question_id in self.question_ids or question_id in self.sub_questions
+
+    def check_question_exists(self, question_id):
+        # Same result shape as the check_question_exists SQL function
+        if self._exists(question_id) or (self._reload_after_miss() and self._exists(question_id)):
+            return {'exists_flag': True, 'similar_questions': []}
+
+        loop_prefix = f"{question_id.upper()}_LOOP["
+        similar = {e['question_id'] for e in self._find(question_id)}
+        similar.update(
+            e['question_id'] for e in self.entries
+            if loop_prefix in e['question_id'].upper()
+        )
+        return {'exists_flag': False, 'similar_questions': sorted(similar)}
+
+    def _question_type(self, base_id):
+        self.load()
+        key = base_id.upper()
+        if key in self.types:
+            return self.types[key]
+        if self.grids.get(key):
+            return self.types[self.grids[key][0].upper()]
+        return None
+
+    def question_type(self, base_id):
+        question_type = self._question_type(base_id)
+        if question_type is None and self._reload_after_miss():
+            question_type = self._question_type(base_id)
+        return question_type
+
+    def grid_variations(self, base_id):
+        self.load()
+        if not self.grids.get(base_id.upper()):
+            self._reload_after_miss()
+        return sorted(set(self.grids.get(base_id.upper(), [])))
+
 class ValidationAgent:
-    def __init__(self):
+    def __init__(self, supabase=None, model=None, survey_id=None):
         load_dotenv()
-        # Initialize Supabase client
-        self.supabase = create_client(
+        # Initialize Supabase client (an existing client can be passed in, e.g. by loadtest.py)
+        self.supabase = supabase or create_client(
             os.getenv('SUPABASE_URL'),
             os.getenv('SUPABASE_KEY')
         )
@@ -61,27 +191,25 @@ class ValidationAgent:
         # self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
         # self.model = "gpt-4"  # Using GPT-4 model
         # Initialize Gemini
-        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        if model is None:
+            genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+            model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.model = model
+        # Everything below is scoped to one survey; SurveyAgentCache keeps one agent per survey
+        self.survey_id = survey_id or DEFAULT_SURVEY_ID
+        self.catalog = SurveyCatalog(self.supabase, self.survey_id)
+        self.analytic_agent = BasicAnalyticAgent(self.supabase, self.survey_id, self.catalog)
+        # Verbatim search keeps its index across queries, so it lives on the agent
+        self.verbatim_agent = VerbatimSearchAgent(self.supabase, self.survey_id)
 
     def find_similar_questions(self, question_id):
         try:
             # Convert to uppercase for consistency
             question_id = question_id.upper()
             
-            # Search for similar question IDs including sub_questions
-            result = self.supabase.table('survey_responses') \
-                .select('question_id', 'sub_question') \
-                .or_(
-                    f"question_id.ilike.%{question_id}%," + 
-                    f"sub_question.ilike.%{question_id}%"
-                ) \
-                .is_not('sub_question', '') \
-                .execute()
-            
-            # Get unique combinations of question_id and sub_question
+            # Search the survey catalog for similar question IDs including sub_questions
             unique_questions = set()
-            for item in result.data:
+            for item in self.catalog.find(question_id):
                 qid = item['question_id']
                 sub_q = item['sub_question']
                 
@@ -114,19 +242,8 @@ class ValidationAgent:
             # Convert to uppercase for consistency
             question_id = question_id.upper()
             
-            # Check for exact match in both question_id and sub_question
-            result = self.supabase.table('survey_responses') \
-                .select('question_id', 'sub_question') \
-                .or_(
-                    f"question_id.eq.{question_id}," +
-                    f"question_id.ilike.%{question_id}%," +
-                    f"sub_question.eq.{question_id}," +
-                    f"sub_question.ilike.%{question_id}%"
-                ) \
-                .limit(1) \
-                .execute()
-            
-            if len(result.data) > 0:
+            # Check for a match in both question_id and sub_question
+            if self.catalog.find(question_id):
                 return True, None
             
             # If no exact match, find similar questions
@@ -188,9 +305,12 @@ class ValidationAgent:
             2. "count" - frequency counts
             3. "summary" - grid summary
             4. "mean" - average calculation (requires factor)
-            5. "none" - unclear request
+            5. "search" - search open-ended verbatim answers (third part is the search text, question_id may be none)
+            6. "none" - unclear request
             
             Required format: operations|question_id|factor(if needed)
+            For search: search|question_id|search text
+            Search text keeps quoted phrases in double quotes and prefixes with a trailing *.
             
             Examples:
             "Give me count and mean for Q3" -> count,mean|Q3|none
@@ -200,6 +320,8 @@ class ValidationAgent:
             "do you have Q43" -> check|Q43|none
             "is there q43" -> check|q43|none
             "check for q43" -> check|q43|none
+            "search Q9 verbatims for 'too expensive'" -> search|Q9|"too expensive"
+            "which open ends mention price" -> search|none|price*
             
             Input: {user_input}
             Output: """
@@ -231,18 +353,7 @@ class ValidationAgent:
     def get_grid_variations(self, base_id):
         try:
             # Get all variations of the grid question, excluding those with open_ended
-            result = self.supabase.table('survey_responses') \
-                .select('question_id') \
-                .ilike('question_id', f"{base_id}[%") \
-                .is_('open_ended', 'null') \
-                .execute()
-            
-            grid_variations = set()
-            for item in result.data:
-                if '[' in item['question_id'] and ']' in item['question_id']:
-                    grid_variations.add(item['question_id'])
-            
-            return sorted(list(grid_variations))
+            return self.catalog.grid_variations(base_id)
         except Exception as e:
             print(f"Error finding grid variations: {e}")
             return []
@@ -295,10 +406,32 @@ class ValidationAgent:
             # Handle summary/grid operations for loop/grid questions
             if operations and any(op.lower() in ['summary', 'grid'] for op in operations) and \
                question_id and ('_loop' in question_id or '[' in question_id):
-                analytic_agent = BasicAnalyticAgent()
+                analytic_agent = self.analytic_agent
                 base_id = question_id.split('[')[0]  # Get base ID for summary
                 return analytic_agent.get_counts(base_id)
 
+            # Handle mean for loop/grid questions: the count matrix is fetched once and kept
+            # with the query context, so every factor mapping that follows reuses it
+            # (only GRID questions: other _loop IDs, e.g. MA loops, take the regular mean flow
+            # and unknown IDs are reported by the existence check below)
+            if operations and 'mean' in operations and \
+               question_id and self.catalog.question_type(question_id.split('[')[0]) == 'GRID':
+                analytic_agent = self.analytic_agent
+                grid_matrix = analytic_agent.get_grid_count_matrix(question_id)
+                if not grid_matrix:
+                    return f"Question {question_id} not found in database"
+
+                self.last_query_needing_factor = {
+                    'operations': operations,
+                    'question_id': question_id,
+                    'grid_matrix': grid_matrix
+                }
+                results = []
+                if 'count' in operations:
+                    results.append(f"{question_id}:\n{grid_matrix.format_counts(single_column='[' in question_id)}")
+                results.append(f"Please provide the factor values for {question_id} (e.g. 'Code 1 --> 23, Code 2 --> 28')")
+                return "\n\n".join(results)
+
             # Handle factor-only responses (including code mappings)
             if not operations and not question_id and factor:
                 # Look up the last query that needed a factor
@@ -308,9 +441,13 @@ class ValidationAgent:
                     
                     # Extract factor mappings if provided
                     factor_mappings = self.extract_factor_mappings(user_input)
+                    if factor_mappings and self.last_query_needing_factor.get('grid_matrix'):
+                        # Grid questions: means for every column from the cached count matrix
+                        return self.last_query_needing_factor['grid_matrix'].format_means(factor_mappings)
+
                     if factor_mappings:
                         # Get the counts
-                        analytic_agent = BasicAnalyticAgent()
+                        analytic_agent = self.analytic_agent
                         counts = analytic_agent.get_counts(question_id)
                         
                         # Calculate weighted mean
@@ -372,19 +509,21 @@ class ValidationAgent:
                         
                         return response
             
+            # Handle verbatim search, which can span all questions
+            if operations and 'search' in operations:
+                search_question = question_id if question_id and question_id.lower() not in ['none', 'all'] else None
+                return self.verbatim_agent.search_verbatims(factor or '', search_question)
+
             # Handle invalid extractions
             if not operations or 'none' in operations or not question_id:
                 return "Please specify your request clearly (e.g. 'count and mean for Q3 by gender')"
 
-            # Check if question exists using check_question_exists function
-            existence_check = self.supabase.rpc(
-                'check_question_exists',
-                {'p_question_id': question_id}  # Use question_id as-is, preserving case
-            ).execute()
+            # Check if question exists in this survey's catalog
+            existence_check = self.catalog.check_question_exists(question_id)  # Use question_id as-is, preserving case
 
-            if existence_check.data:
-                does_exist = existence_check.data.get('exists_flag')
-                similar_questions = existence_check.data.get('similar_questions', [])
+            if existence_check:
+                does_exist = existence_check.get('exists_flag')
+                similar_questions = existence_check.get('similar_questions', [])
 
                 # Handle existence check operation
                 if 'check' in operations:
@@ -411,10 +550,10 @@ class ValidationAgent:
 
             # If question exists, proceed with processing operations
             results = []
-            analytic_agent = BasicAnalyticAgent()
+            analytic_agent = self.analytic_agent
             
-            # Store query context if it needs a factor
-            if 'mean' in operations and not factor:
+            # Store query context for the follow-up factor values
+            if 'mean' in operations:
                 self.last_query_needing_factor = {
                     'operations': operations,
                     'question_id': question_id
@@ -441,33 +580,127 @@ class ValidationAgent:
             print(f"Error processing query: {e}")
             return "I couldn't process that query. Please try again"
 
+class GridCountMatrix:
+    # Count matrix for a grid question: one row per response code, one column per grid column.
+    # Built once from get_grid_question_counts and reused for any number of factor mappings.
+    def __init__(self, columns, codes, counts, bases, totals):
+        self.columns = columns  # grid question IDs, e.g. S5S6_loop[1]
+        self.codes = codes      # response codes, row labels of counts
+        self.counts = counts    # counts[i][j] = respondents giving codes[i] in columns[j]
+        self.bases = bases
+        self.totals = totals
+
+    @classmethod
+    def from_rows(cls, rows):
+        columns = sorted({qid for row in rows for qid in row['counts'].keys()})
+        codes, counts = [], []
+        bases = totals = [0] * len(columns)
+        for row in rows:
+            values = [int(row['counts'].get(qid, '0')) for qid in columns]
+            if row['response_value'] == 'Base':
+                bases = values
+            elif row['response_value'] == 'Total':
+                totals = values
+            else:
+                codes.append(row['response_value'])
+                counts.append(values)
+        return cls(columns, codes, counts, bases, totals)
+
+    def means(self, factor_mappings):
+        # Weighted sums, mapped counts and means for every column in a single pass over the rows.
+        # Codes without a factor are left out of both the sum and the count, as in the single question flow.
+        factors = {str(code).strip(): float(value) for code, value in factor_mappings.items()}
+        weighted_sums = [0.0] * len(self.columns)
+        mapped_counts = [0] * len(self.columns)
+        for code, row in zip(self.codes, self.counts):
+            value = factors.get(code)
+            if value is None:
+                continue
+            weighted_sums = [s + value * c for s, c in zip(weighted_sums, row)]
+            mapped_counts = [n + c for n, c in zip(mapped_counts, row)]
+        means = [s / n if n > 0 else 0 for s, n in zip(weighted_sums, mapped_counts)]
+        return {
+            'columns': self.columns,
+            'bases': self.bases,
+            'counts': mapped_counts,
+            'sums': weighted_sums,
+            'means': means,
+        }
+
+    def format_counts(self, single_column=False):
+        # Same layout as BasicAnalyticAgent.get_counts, without fetching the counts again
+        if single_column:
+            output_lines = [f"Base\t{self.bases[0]}"]
+            output_lines.extend(f"{code}\t{row[0]}" for code, row in zip(self.codes, self.counts) if row[0] > 0)
+            output_lines.append(f"Total\t{sum(row[0] for row in self.counts)}")
+            return "\n".join(output_lines)
+
+        output_lines = ["\t".join([''] + self.columns), ""]
+        output_lines.append("\t".join(['Base'] + [str(b) for b in self.bases]))
+        for code, row in zip(self.codes, self.counts):
+            output_lines.append("\t".join([code] + [str(c) for c in row]))
+        output_lines.append("\t".join(['Total'] + [str(t) for t in self.totals]))
+        return "\n".join(output_lines)
+
+    def format_means(self, factor_mappings):
+        result = self.means(factor_mappings)
+        output_lines = ["\t".join([''] + self.columns), ""]
+        output_lines.append("\t".join(['Base'] + [str(b) for b in self.bases]))
+        for code, row in zip(self.codes, self.counts):
+            output_lines.append("\t".join([code] + [str(c) for c in row]))
+        output_lines.append("\t".join(['Count'] + [str(n) for n in result['counts']]))
+        output_lines.append("\t".join(['Sum'] + [f"{s:.2f}" for s in result['sums']]))
+        output_lines.append("\t".join(['Mean'] + [f"{m:.2f}" for m in result['means']]))
+        output_lines.append("\t".join(['Total'] + [str(t) for t in self.totals]))
+        return "\n".join(output_lines)
+
 class BasicAnalyticAgent:
-    def __init__(self):
+    def __init__(self, supabase=None, survey_id=None, catalog=None):
         load_dotenv()
-        self.supabase = create_client(
+        self.supabase = supabase or create_client(
             os.getenv('SUPABASE_URL'),
             os.getenv('SUPABASE_KEY')
         )
+        self.survey_id = survey_id or DEFAULT_SURVEY_ID
+        self.catalog = catalog or SurveyCatalog(self.supabase, self.survey_id)
+
+    def get_grid_count_matrix(self, question_id):
+        try:
+            base_id = question_id.split('[')[0]
+            # A specific grid column (e.g. S5S6_loop[1]) gives a single column matrix
+            grid_numbers = []
+            if '[' in question_id and ']' in question_id:
+                grid_numbers = [question_id.split('[')[1].split(']')[0]]
+
+            result = self.supabase.rpc(
+                'get_grid_question_counts',
+                {
+                    'p_base_question_id': base_id,
+                    'p_grid_numbers': grid_numbers,
+                    'p_survey_id': self.survey_id
+                }
+            ).execute()
+
+            if not result.data:
+                return None
+            grid_matrix = GridCountMatrix.from_rows(result.data)
+            # Only Base/Total rows means no responses for these columns
+            if not grid_matrix.codes:
+                return None
+            return grid_matrix
+
+        except Exception as e:
+            print(f"Error fetching grid counts: {e}")
+            return None
 
     def get_counts(self, question_id, grid_type=None, grid_numbers=None):
         try:
-            # Get question type - Modified to handle grid questions better
+            # Get question type from the survey catalog - handles grid variations of the base ID
             base_id = question_id.split('[')[0] if '[' in question_id else question_id
-            question_type_response = self.supabase.table('survey_responses') \
-                .select('question_id', 'question_type') \
-                .or_(
-                    f"question_id.ilike.{base_id}[%]," +  # Match any grid variation
-                    f"question_id.eq.{base_id}"           # Match exact base ID
-                ) \
-                .is_('open_ended', 'null') \
-                .limit(1) \
-                .execute()
+            question_type = self.catalog.question_type(base_id)
             
-            if not question_type_response.data:
+            if not question_type:
                 return "Question not found"
-                
-            # Get the question type from the response
-            question_type = question_type_response.data[0]['question_type']
             
             # For GRID questions (summary view)
             if question_type == 'GRID':
@@ -480,7 +713,8 @@ class BasicAnalyticAgent:
                         'get_grid_question_counts',
                         {
                             'p_base_question_id': base_id,
-                            'p_grid_numbers': [grid_num]
+                            'p_grid_numbers': [grid_num],
+                            'p_survey_id': self.survey_id
                         }
                     ).execute()
 
@@ -512,7 +746,8 @@ class BasicAnalyticAgent:
                         'get_grid_question_counts',
                         {
                             'p_base_question_id': base_id,
-                            'p_grid_numbers': []  # Empty array to get all grid variations
+                            'p_grid_numbers': [],  # Empty array to get all grid variations
+                            'p_survey_id': self.survey_id
                         }
                     ).execute()
 
@@ -548,12 +783,13 @@ class BasicAnalyticAgent:
                 # Get base count
                 base_count = self.supabase.rpc(
                     'get_question_count_sa',
-                    {'p_question_id': question_id, 'p_response_value': None}
+                    {'p_question_id': question_id, 'p_response_value': None, 'p_survey_id': self.survey_id}
                 ).execute()
 
                 # Get all unique response values
                 response_data = self.supabase.table('survey_responses') \
                     .select('response_value') \
+                    .eq('survey_id', self.survey_id) \
                     .ilike('question_id', question_id) \
                     .is_('open_ended', 'null') \
                     .execute()
@@ -586,7 +822,7 @@ class BasicAnalyticAgent:
                 for code in unique_codes:
                     count = self.supabase.rpc(
                         'get_question_count_sa',
-                        {'p_question_id': question_id, 'p_response_value': code}
+                        {'p_question_id': question_id, 'p_response_value': code, 'p_survey_id': self.survey_id}
                     ).execute()
                     
                     if count.data > 0:
@@ -601,12 +837,13 @@ class BasicAnalyticAgent:
                 # Get base count with exact match
                 base_count = self.supabase.rpc(
                     'get_question_count_ma',
-                    {'p_question_id': question_id, 'p_response_value': None}
+                    {'p_question_id': question_id, 'p_response_value': None, 'p_survey_id': self.survey_id}
                 ).execute()
 
                 # Get all response values with exact match
                 response_data = self.supabase.table('survey_responses') \
                     .select('response_value') \
+                    .eq('survey_id', self.survey_id) \
                     .eq('question_id', question_id) \
                     .is_('open_ended', 'null') \
                     .execute()
@@ -637,7 +874,7 @@ class BasicAnalyticAgent:
                 for code in unique_codes:
                     count = self.supabase.rpc(
                         'get_question_count_ma',
-                        {'p_question_id': question_id, 'p_response_value': code}
+                        {'p_question_id': question_id, 'p_response_value': code, 'p_survey_id': self.survey_id}
                     ).execute()
                     
                     if count.data > 0:
@@ -654,21 +891,18 @@ class BasicAnalyticAgent:
             return f"Error fetching counts: {str(e)}"
 
     def process_query(self, user_input):
-        validation_agent = ValidationAgent()
+        validation_agent = ValidationAgent(self.supabase, survey_id=self.survey_id)
         question_id = validation_agent.extract_question_id(user_input)
         
         if not question_id:
             return "Please specify a valid question ID (e.g., Q1, S5S6_loop[1])"
 
-        # Use validation agent to check if question exists
-        existence_check = self.supabase.rpc(
-            'check_question_exists',
-            {'p_question_id': question_id}
-        ).execute()
+        # Use the survey catalog to check if question exists
+        existence_check = self.catalog.check_question_exists(question_id)
         
-        if existence_check.data:
-            does_exist = existence_check.data.get('exists_flag')
-            similar_questions = existence_check.data.get('similar_questions', [])
+        if existence_check:
+            does_exist = existence_check.get('exists_flag')
+            similar_questions = existence_check.get('similar_questions', [])
             
             if not does_exist:
                 if similar_questions:
@@ -685,9 +919,320 @@ class BasicAnalyticAgent:
 
         return "Please specify what you want to know about the question (e.g., 'count for Q1')"
 
-# Initialize agents at the module level
-validation_agent = ValidationAgent()
-analytic_agent = BasicAnalyticAgent()
+# Common words left out of keyword frequency counts
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'from', 'i', 'if', 'in',
+    'is', 'it', 'its', 'me', 'my', 'no', 'not', 'of', 'on', 'or', 'so', 'that', 'the',
+    'their', 'they', 'this', 'to', 'too', 'very', 'was', 'we', 'were', 'with', 'you',
+}
+
+class VerbatimIndex:
+    # In-memory inverted index over open_ended answers.
+    # Documents are numbered in load order, so every posting list stays sorted.
+    def __init__(self):
+        self.docs = []                          # (respondent_id, question_id, open_ended)
+        self.doc_tokens = []                    # token list per document, used for phrase checks
+        self.postings = defaultdict(list)       # token -> document ids containing it
+        self.question_docs = defaultdict(list)  # question_id -> document ids
+        self.question_terms = defaultdict(Counter)  # question_id -> keyword frequencies
+        self.vocabulary = []                    # sorted tokens for prefix lookups
+
+    @staticmethod
+    def tokenize(text):
+        # Unicode letters and digits, so accented and non-Latin words stay whole
+        return re.findall(r"[^\W_]+(?:'[^\W_]+)*", str(text).lower())
+
+    def add(self, respondent_id, question_id, text):
+        doc_id = len(self.docs)
+        tokens = self.tokenize(text)
+        # Lookups are case-insensitive, records keep the stored question ID
+        question_key = question_id.upper()
+
+        self.docs.append((respondent_id, question_id, text))
+        self.doc_tokens.append(tokens)
+        for token in dict.fromkeys(tokens):
+            self.postings[token].append(doc_id)
+        self.question_docs[question_key].append(doc_id)
+        self.question_terms[question_key].update(t for t in tokens if t not in STOPWORDS)
+
+    def finalize(self):
+        self.vocabulary = sorted(self.postings)
+
+    def parse_query(self, query):
+        # Returns clauses of ('term', token), ('prefix', token) or ('phrase', [tokens])
+        clauses = []
+        for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query or ''):
+            is_prefix = not phrase and word.endswith('*')
+            tokens = self.tokenize(phrase or word.rstrip('*'))
+            if not tokens:
+                continue
+            if is_prefix:
+                clauses.extend(('term', t) for t in tokens[:-1])
+                clauses.append(('prefix', tokens[-1]))
+            elif len(tokens) > 1:
+                clauses.append(('phrase', tokens))
+            else:
+                clauses.append(('term', tokens[0]))
+        return clauses
+
+    def _prefix_tokens(self, prefix):
+        start = bisect_left(self.vocabulary, prefix)
+        tokens = []
+        for token in self.vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            tokens.append(token)
+        return tokens
+
+    def _clause_docs(self, clause):
+        kind, value = clause
+        if kind == 'term':
+            return self.postings.get(value, [])
+        if kind == 'prefix':
+            docs = set()
+            for token in self._prefix_tokens(value):
+                docs.update(self.postings[token])
+            return sorted(docs)
+        # Phrase: start from its rarest word, the positional check happens per document
+        return min((self.postings.get(t, []) for t in value), key=len)
+
+    def _clause_cost(self, clause):
+        kind, value = clause
+        if kind == 'term':
+            return len(self.postings.get(value, []))
+        if kind == 'prefix':
+            return sum(len(self.postings[t]) for t in self._prefix_tokens(value))
+        return min(len(self.postings.get(t, [])) for t in value)
+
+    @staticmethod
+    def _doc_matches(tokens, clause):
+        kind, value = clause
+        if kind == 'term':
+            return value in tokens
+        if kind == 'prefix':
+            return any(t.startswith(value) for t in tokens)
+        size = len(value)
+        return any(tokens[i:i + size] == value for i in range(len(tokens) - size + 1))
+
+    def search(self, query, question_id=None):
+        # All clauses must match (AND). The cheapest clause is read from the index and
+        # the remaining ones are checked against the candidates' token lists.
+        clauses = self.parse_query(query)
+        question_id = question_id.upper() if question_id else None
+
+        if question_id and (not clauses or len(self.question_docs.get(question_id, [])) <= min(self._clause_cost(c) for c in clauses)):
+            candidates = self.question_docs.get(question_id, [])
+            remaining = clauses
+        elif clauses:
+            seed = min(clauses, key=self._clause_cost)
+            candidates = self._clause_docs(seed)
+            remaining = [c for c in clauses if c is not seed or c[0] == 'phrase']
+        else:
+            candidates = range(len(self.docs))
+            remaining = []
+
+        matches = []
+        for doc_id in candidates:
+            if question_id and self.docs[doc_id][1].upper() != question_id:
+                continue
+            tokens = self.doc_tokens[doc_id]
+            if all(self._doc_matches(tokens, c) for c in remaining):
+                matches.append(doc_id)
+        return matches
+
+    def keyword_counts(self, question_id=None, doc_ids=None, limit=20):
+        if doc_ids is None:
+            if question_id:
+                return self.question_terms.get(question_id.upper(), Counter()).most_common(limit)
+            doc_ids = range(len(self.docs))
+        counts = Counter()
+        for doc_id in doc_ids:
+            counts.update(t for t in self.doc_tokens[doc_id] if t not in STOPWORDS)
+        return counts.most_common(limit)
+
+    def records(self, doc_ids):
+        return [
+            {'respondent_id': respondent_id, 'question_id': question_id, 'open_ended': text}
+            for respondent_id, question_id, text in (self.docs[d] for d in doc_ids)
+        ]
+
+class VerbatimSearchAgent:
+    # Rows fetched per request when building the index (Supabase caps responses at 1000)
+    PAGE_SIZE = 1000
+
+    def __init__(self, supabase=None, survey_id=None):
+        load_dotenv()
+        self.supabase = supabase or create_client(
+            os.getenv('SUPABASE_URL'),
+            os.getenv('SUPABASE_KEY')
+        )
+        self.survey_id = survey_id or DEFAULT_SURVEY_ID
+        self.index = None
+        self.loaded_at = 0.0
+        # Index builds run in worker threads; only one of them should hit the database
+        self.index_lock = threading.Lock()
+
+    def load_index(self, refresh=False):
+        if self.index is not None and not refresh:
+            if time.monotonic() - self.loaded_at >= VERBATIM_INDEX_TTL_SECONDS:
+                self._refresh_in_background()
+            return self.index
+
+        with self.index_lock:
+            if self.index is not None and not refresh:
+                return self.index
+            self.index = self._build_index()
+            self.loaded_at = time.monotonic()
+            return self.index
+
+    def _refresh_in_background(self):
+        # Searches keep using the expired index until the new one is built;
+        # nothing is started if a build is already running
+        if not self.index_lock.acquire(blocking=False):
+            return
+
+        def rebuild():
+            try:
+                self.index = self._build_index()
+            except Exception as e:
+                print(f"Error refreshing verbatim index: {e}")
+            finally:
+                # On failure the old index is kept and retried after another TTL
+                self.loaded_at = time.monotonic()
+                self.index_lock.release()
+
+        threading.Thread(target=rebuild, daemon=True).start()
+
+    def _build_index(self):
+        index = VerbatimIndex()
+        start = 0
+        while True:
+            result = self.supabase.table('survey_responses') \
+                .select('respondent_id', 'question_id', 'open_ended') \
+                .eq('survey_id', self.survey_id) \
+                .not_.is_('open_ended', 'null') \
+                .order('respondent_id,question_id,sub_question') \
+                .range(start, start + self.PAGE_SIZE - 1) \
+                .execute()
+
+            for item in result.data:
+                if item['open_ended'] and item['open_ended'].strip():
+                    index.add(item['respondent_id'], item['question_id'], item['open_ended'])
+
+            if len(result.data) < self.PAGE_SIZE:
+                break
+            start += self.PAGE_SIZE
+
+        index.finalize()
+        return index
+
+    def search(self, query, question_id=None, cursor=0, limit=20):
+        index = self.load_index()
+        doc_ids = index.search(query, question_id)
+        page = doc_ids[cursor:cursor + limit]
+        next_cursor = cursor + limit if cursor + limit < len(doc_ids) else None
+        return {
+            'total': len(doc_ids),
+            'matches': index.records(page),
+            'next_cursor': next_cursor,
+        }
+
+    def iter_matches(self, query, question_id=None, page_size=100):
+        # Runs the search now so errors surface to the caller; pages of matching
+        # respondents are only built as the returned iterator is consumed
+        index = self.load_index()
+        doc_ids = index.search(query, question_id)
+        return (
+            index.records(doc_ids[start:start + page_size])
+            for start in range(0, len(doc_ids), page_size)
+        )
+
+    def keyword_counts(self, question_id, query=None, limit=20):
+        index = self.load_index()
+        doc_ids = index.search(query, question_id) if query else None
+        return index.keyword_counts(question_id, doc_ids, limit)
+
+    def search_verbatims(self, query, question_id=None, limit=20):
+        try:
+            index = self.load_index()
+            doc_ids = index.search(query, question_id)
+            scope = f" in {question_id}" if question_id else ""
+
+            if not doc_ids:
+                return f"No verbatims{scope} match {query}"
+
+            output_lines = [f"Verbatims{scope} matching {query}: {len(doc_ids)}", ""]
+            output_lines.append("Respondent\tQuestion\tVerbatim")
+            for record in index.records(doc_ids[:limit]):
+                text = " ".join(str(record['open_ended']).split())
+                output_lines.append(f"{record['respondent_id']}\t{record['question_id']}\t{text}")
+            output_lines.append(f"Showing 1-{min(limit, len(doc_ids))} of {len(doc_ids)}")
+
+            keywords = index.keyword_counts(doc_ids=doc_ids, limit=10)
+            if keywords:
+                output_lines.append("")
+                output_lines.append("Keyword\tCount")
+                output_lines.extend(f"{keyword}\t{count}" for keyword, count in keywords)
+
+            return "\n".join(output_lines)
+
+        except Exception as e:
+            print(f"Error searching verbatims: {e}")
+            return f"Error searching verbatims: {str(e)}"
+
+class SurveyAgentCache:
+    # One ValidationAgent per survey, so catalogs, verbatim indexes and pending query context
+    # never mix between studies. The least recently used survey is evicted with all its caches.
+    # Surveys without any data are not cached, so requests for unknown IDs cannot evict
+    # the surveys in use; the default survey is always kept, even before it has data.
+    def __init__(self, supabase=None, model=None, max_surveys=MAX_CACHED_SURVEYS):
+        self.supabase = supabase
+        self.model = model
+        self.max_surveys = max_surveys
+        self.agents = OrderedDict()
+
+    def get(self, survey_id=None):
+        survey_id = survey_id or DEFAULT_SURVEY_ID
+        agent = self.agents.get(survey_id)
+        if agent is not None:
+            self.agents.move_to_end(survey_id)
+            return agent
+
+        agent = ValidationAgent(self.supabase, self.model, survey_id)
+        # Reuse the clients of the first agent for every other survey
+        self.supabase = agent.supabase
+        self.model = agent.model
+        if survey_id != DEFAULT_SURVEY_ID and not agent.catalog.load():
+            return None
+        self.agents[survey_id] = agent
+        while len(self.agents) > self.max_surveys:
+            self.agents.popitem(last=False)
+        return agent
+
+    def evict(self, survey_id):
+        return self.agents.pop(survey_id, None) is not None
+
+# Initialize agents at the module level; other surveys get their agent on first use
+survey_agents = SurveyAgentCache()
+survey_agents.get(DEFAULT_SURVEY_ID)
+
+def get_survey_agent(survey_id=None):
+    agent = survey_agents.get(survey_id)
+    if agent is None:
+        raise HTTPException(status_code=404, detail=f"Survey {survey_id} not found")
+    return agent
+
+@app.on_event("startup")
+async def warm_verbatim_index():
+    # Build the default survey's verbatim index in the background, so the first
+    # search from chat does not build it on the event loop
+    def build():
+        try:
+            survey_agents.get(DEFAULT_SURVEY_ID).verbatim_agent.load_index()
+        except Exception as e:
+            print(f"Error building verbatim index: {e}")
+
+    threading.Thread(target=build, daemon=True).start()
 
 @app.get("/")
 async def root():
@@ -695,10 +1240,9 @@ async def root():
 
 @app.post("/query")
 async def process_query(request: QueryRequest):
+    validation_agent = get_survey_agent(request.survey_id)
     try:
-        print(f"Received query: {request.query}")
-        if not validation_agent:
-            raise HTTPException(status_code=500, detail="Validation agent not initialized")
+        print(f"Received query: {request.query} (survey: {request.survey_id or DEFAULT_SURVEY_ID})")
         response = validation_agent.process_query(request.query)
         print(f"Generated response: {response}")
         return QueryResponse(response=response)
@@ -710,7 +1254,8 @@ async def process_query(request: QueryRequest):
         )
 
 @app.post("/validate", response_model=ValidationResponse)
-async def validate_question(question_id: str):
+async def validate_question(question_id: str, survey_id: Optional[str] = None):
+    validation_agent = get_survey_agent(survey_id)
     try:
         is_valid, message = validation_agent.validate_question(question_id)
         similar_questions = validation_agent.find_similar_questions(question_id) if not is_valid else None
@@ -723,13 +1268,58 @@ async def validate_question(question_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/counts/{question_id}")
-async def get_counts(question_id: str):
+async def get_counts(question_id: str, survey_id: Optional[str] = None):
+    analytic_agent = get_survey_agent(survey_id).analytic_agent
     try:
         counts = analytic_agent.get_counts(question_id)
         return {"counts": counts}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/verbatims/search", response_model=VerbatimSearchResponse)
+async def search_verbatims(q: str = "", question_id: Optional[str] = None, cursor: int = Query(0, ge=0),
+                           limit: int = Query(20, ge=1, le=MAX_VERBATIM_PAGE_SIZE),
+                           survey_id: Optional[str] = None):
+    verbatim_agent = get_survey_agent(survey_id).verbatim_agent
+    try:
+        # The first search builds the index; keep that off the event loop
+        result = await run_in_threadpool(verbatim_agent.search, q, question_id, cursor, limit)
+        return VerbatimSearchResponse(**result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/verbatims/search/stream")
+async def stream_verbatims(q: str = "", question_id: Optional[str] = None,
+                          page_size: int = Query(100, ge=1, le=MAX_VERBATIM_PAGE_SIZE),
+                          survey_id: Optional[str] = None):
+    verbatim_agent = get_survey_agent(survey_id).verbatim_agent
+    try:
+        pages = await run_in_threadpool(verbatim_agent.iter_matches, q, question_id, page_size)
+        # One JSON line per page of matching respondents
+        return StreamingResponse(
+            (json.dumps({'matches': page}) + "\n" for page in pages),
+            media_type="application/x-ndjson"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/verbatims/keywords/{question_id}")
+async def get_verbatim_keywords(question_id: str, q: Optional[str] = None,
+                                limit: int = Query(20, ge=1, le=MAX_VERBATIM_PAGE_SIZE), survey_id: Optional[str] = None):
+    verbatim_agent = get_survey_agent(survey_id).verbatim_agent
+    try:
+        keywords = await run_in_threadpool(verbatim_agent.keyword_counts, question_id, q, limit)
+        return {"keywords": [{"keyword": keyword, "count": count} for keyword, count in keywords]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/surveys/{survey_id}/cache")
+async def evict_survey_cache(survey_id: str):
+    # Drops the survey's catalog, verbatim index and query context; they reload on next use.
+    # Caches live per process: with several uvicorn workers this only clears the worker
+    # that handles the request. Catalogs and verbatim indexes still refresh everywhere after their TTL.
+    return {"survey_id": survey_id, "evicted": survey_agents.evict(survey_id)}
+
 @app.options("/query")
 async def options_query():
     return JSONResponse(
@@ -0,0 +1,646 @@
+"""
+Load-testing harness for the XLSX-Chat API.
+
+Replays a weighted mix of chat queries (check/count/summary/mean/search, grid and
+loop IDs) plus direct /counts and /verbatims lookups against the FastAPI app and reports throughput,
+latency percentiles and error rates for each concurrency level and worker count.
+
+The database and LLM are replaced by local stand-ins with injectable latency, so
+runs are repeatable and never touch Supabase or Gemini.
+
+Examples:
+    # In-process (ASGI transport), 1 and 4 worker processes
+    python app/api/chat/loadtest.py --concurrency 1,8,32 --workers 1,4
+
+    # Over HTTP against uvicorn workers started by the harness
+    python app/api/chat/loadtest.py --mode http --workers 1,2,4 --db-latency-ms 20
+
+    # Over HTTP against a server that is already running
+    python app/api/chat/loadtest.py --url http://127.0.0.1:8000
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict
+from types import SimpleNamespace
+
+import httpx
+
+# The module-level agents in agent.py build real clients on import; give them
+# well-formed placeholders so the import succeeds without credentials. The
+# agents are swapped for stand-in backed ones in create_stub_app().
+os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:54321')
+os.environ.setdefault('SUPABASE_KEY', 'loadtest.stub.key')
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+
+# ---------------------------------------------------------------------------
+# Query mix
+# ---------------------------------------------------------------------------
+
+# Each entry: (weight, method, path, body, llm extraction for the query)
+# The extraction is what the stand-in LLM answers for that input, mirroring the
+# "operations|question_id|factor" format requested by extract_operation_and_question.
+QUERY_MIX = [
+    (3, 'POST', '/query', {'query': 'does Q3 exist'}, 'check|Q3|none'),
+    (1, 'POST', '/query', {'query': 'is there Q42'}, 'check|Q42|none'),
+    (5, 'POST', '/query', {'query': 'Give me count for Q3'}, 'count|Q3|none'),
+    (3, 'POST', '/query', {'query': 'count for Q5'}, 'count|Q5|none'),
+    (2, 'POST', '/query', {'query': 'summary of S5S6_loop'}, 'summary|S5S6_loop|none'),
+    (2, 'POST', '/query', {'query': 'count for S5S6_loop[2]'}, 'count|S5S6_loop[2]|none'),
+    (2, 'POST', '/query', {'query': 'count and mean for Q3 by age'}, 'count,mean|Q3|age'),
+    (1, 'POST', '/query', {'query': 'mean for Q1'}, 'mean|Q1|none'),
+    (1, 'POST', '/query', {'query': 'mean for S5S6_loop'}, 'mean|S5S6_loop|none'),
+    (1, 'POST', '/query', {'query': 'Code 1 --> 20, Code 2 --> 30, Code 3 --> 40'}, 'none|none|numeric'),
+    (2, 'POST', '/query', {'query': 'which Q9 verbatims mention price'}, 'search|Q9|price*'),
+    (2, 'GET', '/verbatims/search?q=%22too+expensive%22', None, None),
+    (4, 'GET', '/counts/Q1', None, None),
+    (2, 'GET', '/counts/S5S6_loop', None, None),
+]
+
+# The agents catch their own exceptions and answer 200 with one of these messages,
+# so a response body containing any of them is counted as an error too
+APP_ERROR_MARKERS = [
+    "Error fetching counts",
+    "Error searching verbatims",
+    "Error validating question",
+    "I couldn't process that query",
+]
+
+
+# ---------------------------------------------------------------------------
+# Stand-in database
+# ---------------------------------------------------------------------------
+
+def build_survey_rows(respondents=200, seed=7, survey_id='default'):
+    # Synthetic survey_responses rows covering every question type the agents handle
+    rng = random.Random(seed)
+    rows = []
+
+    def add(rid, question_id, question_type, response_value=None, open_ended=None):
+        rows.append({
+            'survey_id': survey_id,
+            'respondent_id': rid,
+            'question_id': question_id,
+            'sub_question': '',
+            'response_value': response_value,
+            'question_type': question_type,
+            'open_ended': open_ended,
+        })
+
+    for rid in range(1, respondents + 1):
+        add(rid, 'Q1', 'SA', str(rng.randint(1, 2)))
+        add(rid, 'Q3', 'SA', str(rng.randint(1, 5)))
+        codes = sorted(rng.sample(range(1, 7), rng.randint(1, 3)))
+        add(rid, 'Q5', 'MA', '[' + ','.join(str(c) for c in codes) + ']')
+        for grid_num in range(1, 5):
+            add(rid, f'S5S6_loop[{grid_num}]', 'GRID', str(rng.randint(1, 5)))
+        add(rid, 'Q9', 'OE', None, rng.choice([
+            'Too expensive for what you get', 'Good value for the price', 'Nice design but pricey',
+            'The battery does not last', 'Customer service was too slow', 'Easy to set up',
+        ]))
+    return rows
+
+
+def _like_to_regex(pattern):
+    # SQL LIKE: % matches any run, _ matches a single character
+    parts = []
+    for ch in pattern:
+        if ch == '%':
+            parts.append('.*')
+        elif ch == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(ch))
+    return re.compile('^' + ''.join(parts) + '$', re.IGNORECASE | re.DOTALL)
+
+
+def _split_codes(value):
+    if value and value.startswith('[') and value.endswith(']'):
+        return [code for code in value.strip('[]').replace(' ', '').split(',') if code]
+    return [value]
+
+
+class StubQuery:
+    # Mimics the chained supabase/postgrest query builder used in agent.py
+    def __init__(self, db, rows):
+        self.db = db
+        self.rows = rows
+        self.columns = None
+        self.filters = []
+        self.sort_columns = []
+        self.row_limit = None
+        self.row_range = None
+        self.negate_next = False
+
+    def _add_filter(self, condition):
+        if self.negate_next:
+            self.negate_next = False
+            self.filters.append(lambda row: not condition(row))
+        else:
+            self.filters.append(condition)
+        return self
+
+    @property
+    def not_(self):
+        self.negate_next = True
+        return self
+
+    def select(self, *columns):
+        self.columns = columns
+        return self
+
+    def eq(self, column, value):
+        if column == 'survey_id' and not self.negate_next:
+            # Partition pruning: only the survey's own rows are scanned
+            self.rows = self.db.partitions.get(value, [])
+            return self
+        return self._add_filter(lambda row: row.get(column) == value)
+
+    def ilike(self, column, pattern):
+        regex = _like_to_regex(pattern)
+        return self._add_filter(lambda row: row.get(column) is not None and bool(regex.match(str(row[column]))))
+
+    def is_(self, column, value):
+        if value == 'null':
+            return self._add_filter(lambda row: row.get(column) is None)
+        return self._add_filter(lambda row: row.get(column) == value)
+
+    def is_not(self, column, value):
+        if value == 'null':
+            return self._add_filter(lambda row: row.get(column) is not None)
+        return self._add_filter(lambda row: row.get(column) != value)
+
+    def or_(self, expression):
+        conditions = []
+        for condition in expression.split(','):
+            column, op, value = condition.split('.', 2)
+            if op == 'eq':
+                conditions.append(lambda row, c=column, v=value: row.get(c) == v)
+            elif op == 'ilike':
+                regex = _like_to_regex(value)
+                conditions.append(
+                    lambda row, c=column, r=regex: row.get(c) is not None and bool(r.match(str(row[c])))
+                )
+            else:
+                raise ValueError(f"Unsupported or_ operator in stand-in database: {op}")
+        return self._add_filter(lambda row: any(cond(row) for cond in conditions))
+
+    def order(self, column, desc=False):
+        # Like postgrest-py 0.13, each call adds its own order= param and PostgREST only
+        # honours one of them; several sort columns must be passed comma-joined
+        # (desc is appended to the joined string, so it only applies to the last column)
+        names = [name.strip() for name in column.split(',')]
+        self.sort_columns = [(name, desc and i == len(names) - 1) for i, name in enumerate(names)]
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def range(self, start, end):
+        self.row_range = (start, end)
+        return self
+
+    def execute(self):
+        self.db.wait()
+        rows = [row for row in self.rows if all(f(row) for f in self.filters)]
+        for column, desc in reversed(self.sort_columns):
+            rows.sort(key=lambda row: row.get(column), reverse=desc)
+        if self.row_range is not None:
+            rows = rows[self.row_range[0]:self.row_range[1] + 1]
+        if self.row_limit is not None:
+            rows = rows[:self.row_limit]
+        data = [{c: row.get(c) for c in self.columns} if self.columns else dict(row) for row in rows]
+        return SimpleNamespace(data=data)
+
+
+class StubRPC:
+    def __init__(self, db, name, params):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.db.wait()
+        handler = getattr(self.db, f"_rpc_{self.name}", None)
+        if handler is None:
+            raise ValueError(f"Unknown RPC in stand-in database: {self.name}")
+        return SimpleNamespace(data=handler(**self.params))
+
+
+class StubSupabase:
+    # In-memory replacement for the Supabase client with injectable latency.
+    # Latency is applied with a blocking sleep because the real client is synchronous.
+    def __init__(self, rows=None, latency_ms=0.0, jitter_ms=0.0, seed=None):
+        self.rows = rows if rows is not None else build_survey_rows()
+        self.partitions = defaultdict(list)
+        for row in self.rows:
+            self.partitions[row['survey_id']].append(row)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rng = random.Random(seed)
+
+    def wait(self):
+        delay = self.latency_ms + (self.rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def table(self, name):
+        if name != 'survey_responses':
+            raise ValueError(f"Unknown table in stand-in database: {name}")
+        return StubQuery(self, self.rows)
+
+    def rpc(self, name, params):
+        return StubRPC(self, name, params)
+
+    # RPC implementations follow the SQL functions in supabase.md
+    def _rpc_get_survey_catalog(self, p_survey_id):
+        catalog = {}
+        for r in self.partitions.get(p_survey_id, []):
+            key = (r['question_id'], r['sub_question'], r['question_type'])
+            catalog[key] = catalog.get(key, False) or r['open_ended'] is None
+        return [
+            {'question_id': qid, 'sub_question': sub, 'question_type': qtype, 'closed_ended': closed}
+            for (qid, sub, qtype), closed in sorted(catalog.items())
+        ]
+
+    def _rpc_get_question_count_sa(self, p_question_id, p_response_value, p_survey_id='default'):
+        regex = _like_to_regex(p_question_id)
+        rows = [r for r in self.partitions.get(p_survey_id, []) if r['question_type'] == 'SA' and regex.match(r['question_id'])]
+        if p_response_value is None:
+            return len({r['respondent_id'] for r in rows})
+        return sum(1 for r in rows if p_response_value in _split_codes(r['response_value']))
+
+    def _rpc_get_question_count_ma(self, p_question_id, p_response_value, p_survey_id='default'):
+        rows = [r for r in self.partitions.get(p_survey_id, []) if r['question_type'] == 'MA' and r['question_id'] == p_question_id]
+        if p_response_value is None:
+            return len({r['respondent_id'] for r in rows})
+        return sum(1 for r in rows if p_response_value in _split_codes(r['response_value']))
+
+    def _rpc_get_grid_question_counts(self, p_base_question_id, p_grid_numbers, p_survey_id='default'):
+        survey_rows = self.partitions.get(p_survey_id, [])
+        if p_grid_numbers:
+            question_ids = [f"{p_base_question_id}[{num}]" for num in p_grid_numbers]
+        else:
+            prefix = p_base_question_id + '['
+            question_ids = sorted({
+                r['question_id'] for r in survey_rows
+                if r['question_type'] == 'GRID' and r['question_id'].startswith(prefix)
+                and r['question_id'].endswith(']')
+            })
+        if not question_ids:
+            question_ids = [p_base_question_id]
+
+        grid_rows = [r for r in survey_rows if r['question_id'] in question_ids]
+        values = sorted(
+            {r['response_value'] for r in grid_rows if r['response_value'] is not None},
+            key=lambda v: v.zfill(10) if v.isdigit() else v
+        )
+
+        result = []
+        for value in ['Base'] + values + ['Total']:
+            counts = {}
+            for qid in question_ids:
+                column = [r for r in grid_rows if r['question_id'] == qid]
+                if value == 'Base':
+                    counts[qid] = str(len({r['respondent_id'] for r in column}))
+                elif value == 'Total':
+                    counts[qid] = str(sum(1 for r in column if r['response_value'] is not None))
+                else:
+                    counts[qid] = str(sum(1 for r in column if r['response_value'] == value))
+            result.append({'response_value': value, 'counts': counts})
+        return result
+
+    def _rpc_check_question_exists(self, p_question_id, p_survey_id='default'):
+        survey_rows = self.partitions.get(p_survey_id, [])
+        if any(r['question_id'] == p_question_id or r['sub_question'] == p_question_id for r in survey_rows):
+            return {'exists_flag': True, 'similar_questions': []}
+        contains = _like_to_regex(f"%{p_question_id}%")
+        loop = _like_to_regex(f"%{p_question_id.upper()}_loop[%]")
+        similar = sorted({
+            r['question_id'] for r in survey_rows
+            if contains.match(r['question_id']) or contains.match(r['sub_question'])
+            or loop.match(r['question_id'])
+        })
+        return {'exists_flag': False, 'similar_questions': similar}
+
+
+# ---------------------------------------------------------------------------
+# Stand-in LLM
+# ---------------------------------------------------------------------------
+
+class StubModel:
+    # Answers the prompts built in ValidationAgent with scripted replies
+    def __init__(self, extractions=None, latency_ms=0.0, jitter_ms=0.0, seed=None):
+        if extractions is None:
+            extractions = {body['query']: reply for _, _, _, body, reply in QUERY_MIX if reply}
+        self.extractions = extractions
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rng = random.Random(seed)
+
+    def generate_content(self, prompt):
+        delay = self.latency_ms + (self.rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        match = re.search(r"Input: (.*?)\n", prompt)
+        user_input = match.group(1).strip() if match else ''
+
+        if 'Extract code to value mappings' in prompt:
+            mappings = {code: float(value) for code, value in re.findall(r"Code (\d+)\s*-->\s*([\d.]+)", user_input)}
+            return SimpleNamespace(text=json.dumps(mappings))
+        return SimpleNamespace(text=self.extractions.get(user_input, 'none|none|none'))
+
+
+def create_stub_app():
+    # App factory (also used by uvicorn --factory) wiring agent.py to the stand-ins.
+    # Configured through environment variables so spawned uvicorn workers match the CLI.
+    import agent
+
+    seed = int(os.getenv('LOADTEST_SEED', '7'))
+    respondents = int(os.getenv('LOADTEST_RESPONDENTS', '200'))
+    # The mix queries the default survey; archived surveys only add data alongside it
+    rows = build_survey_rows(respondents, seed)
+    for i in range(int(os.getenv('LOADTEST_ARCHIVED_SURVEYS', '0'))):
+        rows.extend(build_survey_rows(respondents, seed + i + 1, f"archive-{i + 1}"))
+    db = StubSupabase(
+        rows=rows,
+        latency_ms=float(os.getenv('LOADTEST_DB_LATENCY_MS', '0')),
+        jitter_ms=float(os.getenv('LOADTEST_DB_JITTER_MS', '0')),
+        seed=seed,
+    )
+    model = StubModel(
+        latency_ms=float(os.getenv('LOADTEST_LLM_LATENCY_MS', '0')),
+        jitter_ms=float(os.getenv('LOADTEST_LLM_JITTER_MS', '0')),
+        seed=seed,
+    )
+    agent.survey_agents = agent.SurveyAgentCache(supabase=db, model=model)
+    return agent.app
+
+
+# ---------------------------------------------------------------------------
+# Load generator
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile on an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_load(client, concurrency, total_requests, seed=0):
+    # Fire total_requests from the query mix using `concurrency` concurrent clients
+    rng = random.Random(seed)
+    weights = [entry[0] for entry in QUERY_MIX]
+    plan = rng.choices(QUERY_MIX, weights=weights, k=total_requests)
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def user():
+        nonlocal next_index, errors
+        while next_index < len(plan):
+            _, method, path, body, _ = plan[next_index]
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                if response.status_code >= 400 or any(m in response.text for m in APP_ERROR_MARKERS):
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {'latencies': latencies, 'errors': errors, 'elapsed': elapsed}
+
+
+class ThreadedASGITransport(httpx.AsyncBaseTransport):
+    # Serves the app on its own event loop thread, as a uvicorn worker would.
+    # Sharing the client's loop would hide queueing: the blocking agent code would
+    # stall the load generator itself instead of showing up as request latency.
+    def __init__(self, app):
+        self.transport = httpx.ASGITransport(app=app)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def handle_async_request(self, request):
+        future = asyncio.run_coroutine_threadsafe(self.transport.handle_async_request(request), self.loop)
+        return await asyncio.wrap_future(future)
+
+    async def aclose(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def _make_client(mode, url, timeout):
+    if mode == 'inprocess':
+        transport = ThreadedASGITransport(create_stub_app())
+        return httpx.AsyncClient(transport=transport, base_url='http://loadtest', timeout=timeout)
+    return httpx.AsyncClient(base_url=url, timeout=timeout)
+
+
+def _worker(mode, url, concurrency, total_requests, seed, timeout):
+    # Runs one worker's share of the load; agent.py prints on every query, so silence it
+    async def main():
+        async with _make_client(mode, url, timeout) as client:
+            return await run_load(client, concurrency, total_requests, seed)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return asyncio.run(main())
+
+
+def _split(total, parts):
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def run_inprocess_level(workers, concurrency, total_requests, timeout):
+    # Each worker process hosts its own copy of the app, like a uvicorn worker
+    if workers == 1:
+        return [_worker('inprocess', None, concurrency, total_requests, 0, timeout)]
+    shares = zip(_split(concurrency, workers), _split(total_requests, workers))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_worker, 'inprocess', None, max(1, c), r, seed, timeout)
+            for seed, (c, r) in enumerate(shares) if r
+        ]
+        return [f.result() for f in futures]
+
+
+def run_http_level(url, concurrency, total_requests, timeout):
+    return [_worker('http', url, concurrency, total_requests, 0, timeout)]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def spawn_server(workers, env_overrides, startup_timeout=30, settle=2.0):
+    # Starts uvicorn with the stand-in app factory and the requested worker count
+    port = _free_port()
+    env = dict(os.environ, **env_overrides)
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'uvicorn', 'loadtest:create_stub_app', '--factory',
+            '--app-dir', APP_DIR, '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(workers), '--log-level', 'warning',
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            try:
+                if httpx.get(url + '/', timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"uvicorn with {workers} worker(s) failed to start on {url}")
+            time.sleep(0.2)
+        # The first worker to answer is not the last one to boot; give the rest time
+        # to start accepting so connections spread across all of them
+        time.sleep(settle)
+        yield url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def summarize(mode, workers, concurrency, results):
+    latencies = sorted(l for r in results for l in r['latencies'])
+    errors = sum(r['errors'] for r in results)
+    elapsed = max(r['elapsed'] for r in results)
+    count = len(latencies)
+    return {
+        'mode': mode,
+        'workers': workers,
+        'concurrency': concurrency,
+        'requests': count,
+        'errors': errors,
+        'error_rate': errors / count if count else 0.0,
+        'throughput_rps': count / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p90_ms': percentile(latencies, 90),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': latencies[-1] if latencies else 0.0,
+    }
+
+
+def format_report(rows):
+    header = ['mode', 'workers', 'conc', 'requests', 'errors', 'err%', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms']
+    lines = ["\t".join(header)]
+    for row in rows:
+        lines.append("\t".join([
+            row['mode'],
+            str(row['workers']),
+            str(row['concurrency']),
+            str(row['requests']),
+            str(row['errors']),
+            f"{row['error_rate'] * 100:.1f}",
+            f"{row['throughput_rps']:.1f}",
+            f"{row['p50_ms']:.1f}",
+            f"{row['p90_ms']:.1f}",
+            f"{row['p99_ms']:.1f}",
+            f"{row['max_ms']:.1f}",
+        ]))
+    return "\n".join(lines)
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the XLSX-Chat API with stand-in DB and LLM")
+    parser.add_argument('--mode', choices=['inprocess', 'http'],
+                        help="Defaults to http when --url is given, inprocess otherwise")
+    parser.add_argument('--url', help="Target an already running server (implies http mode); worker counts are then ignored")
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 4, 16, 64], help="Comma separated levels")
+    parser.add_argument('--workers', type=_int_list, default=[1], help="Comma separated worker counts")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument('--db-latency-ms', type=float, default=5.0)
+    parser.add_argument('--db-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--llm-latency-ms', type=float, default=50.0)
+    parser.add_argument('--llm-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--respondents', type=int, default=200, help="Rows per question in the stand-in database")
+    parser.add_argument('--archived-surveys', type=int, default=0,
+                        help="Extra surveys stored next to the one under load")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON instead of a table")
+    args = parser.parse_args(argv)
+
+    # Never measure the in-process stand-in when a real server was asked for
+    if args.url and args.mode == 'inprocess':
+        parser.error("--url cannot be combined with --mode inprocess")
+    if args.mode is None:
+        args.mode = 'http' if args.url else 'inprocess'
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stub_env = {
+        'LOADTEST_DB_LATENCY_MS': str(args.db_latency_ms),
+        'LOADTEST_DB_JITTER_MS': str(args.db_jitter_ms),
+        'LOADTEST_LLM_LATENCY_MS': str(args.llm_latency_ms),
+        'LOADTEST_LLM_JITTER_MS': str(args.llm_jitter_ms),
+        'LOADTEST_RESPONDENTS': str(args.respondents),
+        'LOADTEST_ARCHIVED_SURVEYS': str(args.archived_surveys),
+    }
+    # Worker processes read the stand-in configuration from the environment
+    os.environ.update(stub_env)
+
+    rows = []
+    if args.mode == 'http' and args.url:
+        for concurrency in args.concurrency:
+            results = run_http_level(args.url, concurrency, args.requests, args.timeout)
+            rows.append(summarize('http', '-', concurrency, results))
+    else:
+        for workers in args.workers:
+            if args.mode == 'http':
+                with spawn_server(workers, stub_env) as url:
+                    for concurrency in args.concurrency:
+                        results = run_http_level(url, concurrency, args.requests, args.timeout)
+                        rows.append(summarize('http', workers, concurrency, results))
+            else:
+                for concurrency in args.concurrency:
+                    results = run_inprocess_level(workers, concurrency, args.requests, args.timeout)
+                    rows.append(summarize('inprocess', workers, concurrency, results))
+
+    print(json.dumps(rows, indent=2) if args.json else format_report(rows))
+    return rows
+
+
+if __name__ == '__main__':
+    main()